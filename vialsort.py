@@ -13,12 +13,44 @@
 
 
 import sys
+import math
+import contextlib
+import array
+import shutil
+import re
+import random
+import itertools
+
+# termios and tty are only available on Unix-like systems. Without them, input is read a whole line at a time.
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+    tty = None
+
 import json
 
+# orjson parses puzzles considerably faster, but it is optional.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_fast_json_loads = json.loads if orjson is None else orjson.loads
+
+
+# Sequences written directly to the screen are bytes, since frames are written to the binary stream underneath sys.stderr.
+
+_ANSI_CLEAR = b'\033[2J'
+
+_ANSI_GO_HOME = b'\033[H'
 
-_ANSI_CLEAR = '\033[2J'
+_ANSI_CLEAR_TO_LINE_END = b'\033[K'
 
-_ANSI_GO_HOME = '\033[H'
+_ANSI_CLEAR_TO_SCREEN_END = b'\033[J'
+
+_ANSI_ESCAPE_PATTERN = re.compile(rb'\033\[[0-9;]*[A-Za-z]')
 
 _ANSI_INVERT = '\033[7m'
 
@@ -43,27 +75,100 @@ _ANSI_NORMAL = '\033[0m'
 
 _SYMBOLS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
 
+# Layout of the board on screen, in columns.
+
+_UNIT_WIDTH = 3
+
+_NUMBER_PAD = 2
+
+_SPACE_BETWEEN_VIALS = 4
+
+_DEFAULT_TERM_WIDTH = 80
+
+# Every way a unit can be drawn, indexed by color. The combination of foreground color and symbol repeats after the least common multiple of their counts, so any color maps to a cell with a single modulo.
+
+_CELLS = tuple(
+    f'{_ANSI_INVERT}{_ANSI_FG_COLORS[color % len(_ANSI_FG_COLORS)]} {_SYMBOLS[color % len(_SYMBOLS)]} {_ANSI_NORMAL}'.encode('ascii')
+    for color in range(len(_ANSI_FG_COLORS) * len(_SYMBOLS) // math.gcd(len(_ANSI_FG_COLORS), len(_SYMBOLS)))
+)
+
+_EMPTY_CELL = b' ' * _UNIT_WIDTH
+
+
+# Zobrist hashing assigns a random 64-bit key to every (position, color) pair. A vial's hash is the XOR of the keys of its units, so moving a unit in or out of a vial only needs one XOR.
+#
+# Keys are drawn lazily from a fixed seed the first time each pair is seen.
+
+_HASH_MASK = (1 << 64) - 1
+
+_zobrist_random = random.Random(0)
+
+_zobrist_keys = dict()
+
+
+def _zobrist_key(position, color):
+    key = _zobrist_keys.get((position, color))
+    if key is None:
+        key = _zobrist_random.getrandbits(64)
+        _zobrist_keys[(position, color)] = key
+    return key
+
 
 # An Action represents an atomic operation on the game board.
 #
-# The apply method should return False if the operation has no effect. In this case it will not be added to the history. It should return True otherwise.
+# The apply method should return False if the operation has no effect. In this case it will not be added to the history. Otherwise, it should return a history record: an integer packed by _pack_record that describes what was done.
 #
-# The undo method can assume that the board state is equivalent to the state that its apply method left it in. In other words, it does not need to have as stringent checks as the apply method.
+# The Board's history only stores these records, not the Action objects. To undo an action, the Board passes the record to the static undo method of the Action class identified by the record's kind. The undo method can assume that the board state is equivalent to the state that its apply method left it in. In other words, it does not need to have as stringent checks as the apply method.
 #
 # Using a C++ term, Actions are 'friends' of the Board. In other words, Actions can access private fields (fields starting with '_') of the Board.
 
 
+# History record layout: kind (8 bits), then from index, to index, and quantity (18 bits each), which fits in a signed 64-bit integer. Kinds start at 1 so that a record is never zero.
+
+_ACTION_POUR = 1
+
+_ACTION_ADD_EMPTY_VIAL = 2
+
+_RECORD_FIELD_BITS = 18
+
+_RECORD_FIELD_MASK = (1 << _RECORD_FIELD_BITS) - 1
+
+
+def _pack_record(kind, from_index=0, to_index=0, qty=0):
+
+    # Raise rather than silently truncating a field, which would make undo corrupt the board.
+    for field in (from_index, to_index, qty):
+        if field < 0 or field > _RECORD_FIELD_MASK:
+            raise ValueError(f'Cannot record an action involving {field} (must be between 0 and {_RECORD_FIELD_MASK})')
+
+    return kind | (from_index << 8) | (to_index << (8 + _RECORD_FIELD_BITS)) | (qty << (8 + 2 * _RECORD_FIELD_BITS))
+
+
+def _unpack_record(record):
+    return (
+        record & 0xFF,
+        (record >> 8) & _RECORD_FIELD_MASK,
+        (record >> (8 + _RECORD_FIELD_BITS)) & _RECORD_FIELD_MASK,
+        (record >> (8 + 2 * _RECORD_FIELD_BITS)) & _RECORD_FIELD_MASK,
+    )
+
+
 class PourAction:
 
+    __slots__ = ('_from_index', '_to_index')
+
     def __init__(self, from_index, to_index):
+        self._reset(from_index, to_index)
+
+    def _reset(self, from_index, to_index):
         self._from_index = from_index
         self._to_index = to_index
-        self._qty_moved = 0
-        self._applied = False
 
     def apply(self, board):
 
-        self._applied = True
+        # Pouring a vial into itself has no effect.
+        if self._from_index == self._to_index:
+            return False
 
         from_vial = board.vials[self._from_index]
         to_vial = board.vials[self._to_index]
@@ -73,44 +178,144 @@ class PourAction:
 
         color = from_vial[-1]
 
+        # An empty destination accepts any color, so its top unit only needs to be compared otherwise.
         if len(to_vial) > 0 and to_vial[-1] != color:
             return False
 
-        while len(from_vial) > 0 and from_vial[-1] == color and len(to_vial) < board.vial_size:
-            to_vial.append(from_vial[-1])
-            from_vial.pop()
-            self._qty_moved = self._qty_moved + 1
+        # At most this many units can move: limited by both the source's contents and the destination's free space.
+        limit = min(len(from_vial), board.vial_size - len(to_vial))
 
-        return self._qty_moved > 0
+        if limit <= 0:
+            return False
 
-    def undo(self, board):
+        # The top unit is already known to match, so the scan of the run starts below it.
+        qty_moved = 1
 
-        if not self._applied:
-            raise ValueError('Action not yet applied')
+        while qty_moved < limit and from_vial[-1-qty_moved] == color:
+            qty_moved = qty_moved + 1
 
-        from_vial = board.vials[self._from_index]
-        to_vial = board.vials[self._to_index]
+        # Packed before the board is changed, so that an action that cannot be recorded leaves the board untouched.
+        record = _pack_record(_ACTION_POUR, self._from_index, self._to_index, qty_moved)
+
+        board._transfer(self._from_index, self._to_index, color, qty_moved)
+
+        return record
 
-        for i in range(self._qty_moved):
-            from_vial.append(to_vial.pop())
+    @staticmethod
+    def undo(board, record):
+
+        _, from_index, to_index, qty_moved = _unpack_record(record)
+
+        # The units that were moved are on top of the destination vial, so their color does not need to be recorded.
+        color = board.vials[to_index][-1]
+
+        board._transfer(to_index, from_index, color, qty_moved)
 
 
 class AddEmptyVialAction:
 
+    __slots__ = ()
+
     def apply(self, board):
-        board.vials.append(list())
-        return True
+        # Vial indices must fit in a history record, so a board cannot grow past _RECORD_FIELD_MASK vials.
+        if len(board.vials) >= _RECORD_FIELD_MASK:
+            return False
+        board._append_vial(board._make_empty_vial())
+        return _pack_record(_ACTION_ADD_EMPTY_VIAL)
 
-    def undo(self, board):
-        board.vials.pop()
+    @staticmethod
+    def undo(board, record):
+        board._pop_vial()
+
+
+_UNDO_BY_KIND = {
+    _ACTION_POUR: PourAction.undo,
+    _ACTION_ADD_EMPTY_VIAL: AddEmptyVialAction.undo,
+}
 
 
 class Board:
 
+    __slots__ = ('vial_size', 'vials', '_history', '_action_pool', '_vial_hashes', '_hash', '_max_color', '_solved_count')
+
     def __init__(self, vial_size, vials, history=tuple()):
         self.vial_size = vial_size
         self.vials = vials
-        self._history = list(history)
+
+        # The history holds the records returned by Action.apply (see _pack_record), not Action objects.
+        self._history = array.array('q', history)
+
+        # PourActions that are no longer in use, kept so that pouring does not need to allocate a new one every time. The history only stores records, so an action can be reused as soon as it has been applied.
+        self._action_pool = list()
+
+        # No action adds new colors to the board, so the highest color can be computed once up front.
+        self._max_color = self._compute_max_color(vials)
+
+        # The number of vials that are solved. The board is solved when all of them are. Only vials touched by an action can change, so this is kept up to date incrementally.
+        self._solved_count = sum(1 for vial in vials if self._is_vial_solved(vial))
+
+        # The board hash is the sum of the vial hashes, so it does not depend on the order of the vials. Empty vials hash to zero.
+        self._vial_hashes = [self._compute_vial_hash(vial) for vial in vials]
+        self._hash = sum(self._vial_hashes) & _HASH_MASK
+
+    @staticmethod
+    def _compute_vial_hash(vial):
+        ret = 0
+        for position, color in enumerate(vial):
+            ret ^= _zobrist_key(position, color)
+        return ret
+
+    def _set_vial_hash(self, vial_index, vial_hash):
+        self._hash = (self._hash - self._vial_hashes[vial_index] + vial_hash) & _HASH_MASK
+        self._vial_hashes[vial_index] = vial_hash
+
+    def _transfer(self, from_index, to_index, color, qty):
+
+        # Moves the top qty units (all of the given color) from one vial to another, keeping the hashes and solved count up to date.
+
+        from_vial = self.vials[from_index]
+        to_vial = self.vials[to_index]
+
+        from_hash = self._vial_hashes[from_index]
+        for position in range(len(from_vial) - qty, len(from_vial)):
+            from_hash ^= _zobrist_key(position, color)
+
+        to_hash = self._vial_hashes[to_index]
+        for position in range(len(to_vial), len(to_vial) + qty):
+            to_hash ^= _zobrist_key(position, color)
+
+        solved_before = self._is_vial_solved(from_vial) + self._is_vial_solved(to_vial)
+
+        to_vial.extend((color,) * qty)
+        del from_vial[-qty:]
+
+        self._solved_count += self._is_vial_solved(from_vial) + self._is_vial_solved(to_vial) - solved_before
+
+        self._set_vial_hash(from_index, from_hash)
+        self._set_vial_hash(to_index, to_hash)
+
+    def _make_empty_vial(self):
+        # New vials use the same storage type as the existing ones.
+        if len(self.vials) == 0:
+            return list()
+        return type(self.vials[0])()
+
+    def _append_vial(self, vial):
+        self.vials.append(vial)
+        self._solved_count += self._is_vial_solved(vial)
+        self._vial_hashes.append(0)
+        self._set_vial_hash(len(self.vials) - 1, self._compute_vial_hash(vial))
+
+    def _pop_vial(self):
+        self._set_vial_hash(len(self.vials) - 1, 0)
+        self._vial_hashes.pop()
+        vial = self.vials.pop()
+        self._solved_count -= self._is_vial_solved(vial)
+        return vial
+
+    def get_state_hash(self):
+        # Two boards with the same vials (in any order) have the same hash, which makes it suitable for detecting already visited states.
+        return self._hash
 
     def is_vial_empty(self, vial_index):
         return len(self.vials[vial_index]) == 0
@@ -119,57 +324,71 @@ class Board:
         return len(self.vials)
     
     def apply_action(self, action):
-        if not action.apply(self):
-            return
-        self._history.append(action)
+        record = action.apply(self)
+        if not record:
+            return False
+        self._history.append(record)
+        return True
 
     def undo(self):
         if len(self._history) == 0:
             return
-        action = self._history.pop()
-        action.undo(self)
+        record = self._history.pop()
+        _UNDO_BY_KIND[record & 0xFF](self, record)
 
-    def get_max_color(self):
-        ret = 0
+    def _acquire_pour(self, from_vial_index, to_vial_index):
+        if len(self._action_pool) == 0:
+            return PourAction(from_vial_index, to_vial_index)
+        action = self._action_pool.pop()
+        action._reset(from_vial_index, to_vial_index)
+        return action
 
-        for vial in self.vials:
-            for obj in vial:
-                ret = max(ret, obj)
+    @staticmethod
+    def _compute_max_color(vials):
+        # Boards with no units (or only negative colors) report 0.
+        return max(0, max((max(vial) for vial in vials if vial), default=0))
 
-        return ret
+    def get_max_color(self):
+        return self._max_color
 
-    def is_solved(self):
+    def _is_vial_solved(self, vial):
 
-        # A board is solved if all of its vials are solved.
-        # A vial is solved if it is either empty, or full of only one color
+        # A vial is solved if it is either empty, or full of only one color.
 
-        for vial in self.vials:
+        if len(vial) == 0:
+            return True
 
-            if len(vial) == 0:
-                continue
-
-            if len(vial) != self.vial_size:
-                return False
+        if len(vial) != self.vial_size:
+            return False
 
-            first_elem = vial[0]
-            for elem in vial:
-                if elem != first_elem:
-                    return False
+        # count() compares every unit against the first one in C, rather than one Python comparison per unit.
+        return vial.count(vial[0]) == len(vial)
 
-        return True
+    def is_solved(self):
+        # A board is solved if all of its vials are solved.
+        return self._solved_count == len(self.vials)
 
     def pour(self, from_vial_index, to_vial_index):
-        self.apply_action(PourAction(from_vial_index, to_vial_index))
+        action = self._acquire_pour(from_vial_index, to_vial_index)
+        self.apply_action(action)
+        self._action_pool.append(action)
 
     def add_empty_vial(self):
         self.apply_action(AddEmptyVialAction())
 
 
 def load_board(line):
+    return _load_board(line, _fast_json_loads)
+
+
+def _load_board(line, json_loads):
 
     try:
-        data = json.loads(line)
+        data = json_loads(line)
     except ValueError as e:
+        # orjson is stricter than the json module (for example, it rejects NaN and Infinity), so a document it rejects may still be valid.
+        if json_loads is not json.loads:
+            return _load_board(line, json.loads)
         raise ValueError(f'Invalid JSON ({e})') from e
 
     if 'vial_size' not in data:
@@ -177,6 +396,10 @@ def load_board(line):
 
     vial_size = data['vial_size']
 
+    # orjson parses integers outside of the 64-bit range as floats, while the puzzle format allows any integer. Such puzzles are parsed again with the json module, which keeps them exact.
+    if isinstance(vial_size, float) and json_loads is not json.loads:
+        return _load_board(line, json.loads)
+
     if 'vials' not in data:
         raise ValueError('Key "vials" is required')
 
@@ -185,6 +408,14 @@ def load_board(line):
     if not isinstance(vials, (list, tuple)):
         raise ValueError('Key "vials" must be an array')
 
+    # Moves are recorded in the history as packed integers (see _pack_record), which limits how large a playable board can be.
+
+    if vial_size > _RECORD_FIELD_MASK:
+        raise ValueError(f'Key "vial_size" must be at most {_RECORD_FIELD_MASK}')
+
+    if len(vials) > _RECORD_FIELD_MASK:
+        raise ValueError(f'Key "vials" must contain at most {_RECORD_FIELD_MASK} vials')
+
     for vial in vials:
 
         if not isinstance(vial, (list, tuple)):
@@ -193,9 +424,17 @@ def load_board(line):
         if len(vial) > vial_size:
             raise ValueError('Vial contains too many units')
 
-        for unit in vial:
-            if not isinstance(unit, int):
-                raise ValueError('Every element in every vial must be an integer.')
+    # Checks every unit of every vial in one pass, rather than one Python-level isinstance call per unit.
+    if not all(map(int.__instancecheck__, itertools.chain.from_iterable(vials))):
+        if json_loads is not json.loads:
+            return _load_board(line, json.loads)
+        raise ValueError('Every element in every vial must be an integer.')
+
+    # A bytearray stores one byte per unit instead of a pointer to an int object, so it is used whenever every color fits in a byte. bytearray supports the same operations as list, so the rest of the code works with either.
+    try:
+        vials = [bytearray(vial) for vial in vials]
+    except ValueError:
+        vials = [list(vial) for vial in vials]
 
     return Board(
         vial_size = vial_size,
@@ -203,36 +442,189 @@ def load_board(line):
     )
 
 
-def draw_vial(vial_index, vial, vial_size, file):
+def draw_vial(vial_index, vial, vial_size):
 
-    unit_width = 3
-    number_pad = 2
+    # Returns the vial drawn as bytes, so that a whole frame can be joined and written at once without encoding.
 
-    display_index = str(vial_index+1).rjust(number_pad)
+    display_index = str(vial_index+1).rjust(_NUMBER_PAD)
 
-    print(f'{display_index}.', end='', file=file)
+    parts = [f'{display_index}.'.encode('ascii')]
+    parts.extend(_CELLS[unit % len(_CELLS)] for unit in vial)
+    parts.append(_EMPTY_CELL * (vial_size - len(vial)))
 
-    for index in range(vial_size):
+    return b''.join(parts)
 
-        if index < len(vial):
-            unit = vial[index]
-        else:
-            unit = None
 
-        if unit is not None:
+class Renderer:
+
+    # Draws frames (as bytes) to a binary stream connected to the terminal. Only the lines that differ from the previously drawn frame are rewritten, by moving the cursor to them directly.
+    #
+    # The whole screen is cleared and redrawn for the first frame, when the terminal is resized, when the frame is too tall for the terminal (as the terminal would scroll), and when any line is too wide for the terminal (as it would wrap onto the next row). In the latter two cases the row numbers of the lines would not match the screen.
 
-            ansi_fg = _ANSI_FG_COLORS[unit % len(_ANSI_FG_COLORS)]
-            symbol = _SYMBOLS[unit % len(_SYMBOLS)]
+    def __init__(self, file):
+        self._file = file
+        self._last_lines = None
+        self._last_size = None
 
-            print(_ANSI_INVERT, end='', file=file)
-            print(ansi_fg, end='', file=file)
+    def draw(self, frame):
 
-            print(' ' + symbol + ' ', end='', file=file)
+        lines = frame.split(b'\n')
+        size = shutil.get_terminal_size()
 
-            print(_ANSI_NORMAL, end='', file=file)
+        if self._last_lines is None or size != self._last_size or len(lines) >= size.lines or self._has_wrapping_line(lines, size.columns):
+            self._file.write(_ANSI_CLEAR + _ANSI_GO_HOME + frame)
 
         else:
-            print(' '*unit_width, end='', file=file)
+            parts = list()
+
+            for row, line in enumerate(lines):
+
+                # The last line is always rewritten so that the cursor ends up after it, and so that any input echoed after it by the terminal is erased.
+                if row == len(lines) - 1 or row >= len(self._last_lines) or line != self._last_lines[row]:
+                    parts.append(b'\033[%d;1H%s%s' % (row+1, line, _ANSI_CLEAR_TO_LINE_END))
+
+            parts.append(_ANSI_CLEAR_TO_SCREEN_END)
+
+            self._file.write(b''.join(parts))
+
+        self._file.flush()
+
+        self._last_lines = lines
+        self._last_size = size
+
+    @staticmethod
+    def _has_wrapping_line(lines, columns):
+        # A line exactly as wide as the terminal is included, since clearing to the end of the line would erase its last character.
+        for line in lines:
+            if len(_ANSI_ESCAPE_PATTERN.sub(b'', line)) >= columns:
+                return True
+        return False
+
+
+# Keys that run their command as soon as they are pressed, if nothing else has been typed yet.
+_IMMEDIATE_KEYS = ('c', 'u', 'v')
+
+
+@contextlib.contextmanager
+def _raw_mode(stream):
+
+    # Puts the terminal in cbreak mode: keys are delivered as soon as they are pressed and are not echoed. Ctrl+C still interrupts.
+
+    fd = stream.fileno()
+    old_attrs = termios.tcgetattr(fd)
+
+    try:
+        tty.setcbreak(fd)
+        yield
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_attrs)
+
+
+def _skip_escape_sequence():
+
+    # Consumes the rest of an escape sequence (such as the one sent by an arrow key) after its initial escape character, so that none of it is taken as typed input.
+    #
+    # CSI sequences ('[' followed by parameters) end with a character between '@' and '~'. SS3 sequences ('O') are followed by one character. Anything else is an alt+key combination, which is one character long.
+
+    char = sys.stdin.read(1)
+
+    if char == '[':
+        while True:
+            char = sys.stdin.read(1)
+            if char == '' or '@' <= char <= '~':
+                return
+
+    if char == 'O':
+        sys.stdin.read(1)
+
+
+def _read_command(num_vials, file):
+
+    # Reads a command one key at a time, echoing typed keys to file (a binary stream).
+    #
+    # A vial number is submitted as soon as no further digit could make it a valid vial number, so that on boards with fewer than ten vials a single key press is enough. Single-key commands are submitted immediately. Anything else is submitted with enter.
+
+    buf = list()
+
+    while True:
+
+        char = sys.stdin.read(1)
+
+        if char == '':
+            raise EOFError
+
+        if char in ('\n', '\r'):
+            return ''.join(buf).strip()
+
+        if char in ('\x7f', '\b'):
+            if len(buf) > 0:
+                buf.pop()
+                file.write(b'\b \b')
+                file.flush()
+            continue
+
+        if char == '\x1b':
+            _skip_escape_sequence()
+            continue
+
+        if not char.isprintable():
+            continue
+
+        if len(buf) == 0 and char.lower() in _IMMEDIATE_KEYS:
+            return char
+
+        buf.append(char)
+        file.write(char.encode('utf-8'))
+        file.flush()
+
+        typed = ''.join(buf)
+
+        # isdecimal rather than isdigit, as int() rejects some digit characters such as superscripts.
+        if typed.isdecimal() and int(typed) * 10 > num_vials:
+            return typed
+
+
+# Command handlers. Each one takes the board and the selected vial index, and returns the new selected vial index along with a comment to show the player (or None).
+
+
+def _cmd_help(board, selected_vial_index):
+    lines = [
+        #================================================================================
+        'help: Show this message',
+        'u: Undo last action',
+        'v: Add an empty vial',
+    ]
+    return selected_vial_index, '\n'.join(lines)
+
+
+def _cmd_undo(board, selected_vial_index):
+    board.undo()
+    return selected_vial_index, None
+
+
+def _cmd_cancel(board, selected_vial_index):
+    return None, None
+
+
+def _cmd_add_vial(board, selected_vial_index):
+    board.add_empty_vial()
+    return selected_vial_index, None
+
+
+def _cmd_xyzzy(board, selected_vial_index):
+    return selected_vial_index, 'Nothing happens'
+
+
+# Commands are matched case-insensitively.
+
+_COMMANDS = {
+    'help': _cmd_help,
+    'u': _cmd_undo,
+    'undo': _cmd_undo,
+    'c': _cmd_cancel,
+    'v': _cmd_add_vial,
+    'xyzzy': _cmd_xyzzy,
+}
 
 
 def play_board(board):
@@ -243,110 +635,96 @@ def play_board(board):
 
     comment = None
 
-    file = sys.stderr
+    # Frames are assembled as bytes and written to the binary buffer of stderr, which skips the text layer's encoder.
+    file = sys.stderr.buffer
 
+    renderer = Renderer(file)
 
-    while playing:
+    vial_draw_size = _NUMBER_PAD + 1 + (_UNIT_WIDTH * board.vial_size) + _SPACE_BETWEEN_VIALS
 
-        print(_ANSI_CLEAR, end='', file=file)
-        print(_ANSI_GO_HOME, end='', file=file)
+    vial_spacer = b' ' * _SPACE_BETWEEN_VIALS
 
-        unit_width = 3
-        number_pad = 2
-        space_between_vials = 4
+    while playing:
 
-        vial_draw_size = number_pad + 1 + (unit_width * board.vial_size) + space_between_vials
+        # The frame is accumulated here and drawn with a single call at the end, rather than one write per escape sequence.
+        frame_buf = list()
 
-        term_width = 80
+        # Queried on every frame so that the layout follows the terminal when it is resized.
+        term_width = shutil.get_terminal_size((_DEFAULT_TERM_WIDTH, 24)).columns
         pos_x = 0
 
         for vial_index in range(len(board.vials)):
 
-            draw_vial(vial_index, board.vials[vial_index], board.vial_size, file=file)
+            frame_buf.append(draw_vial(vial_index, board.vials[vial_index], board.vial_size))
 
-            print(' ' * space_between_vials, end='', file=file)
+            frame_buf.append(vial_spacer)
 
             pos_x = pos_x + vial_draw_size
 
             if pos_x + vial_draw_size >= term_width:
                 pos_x = 0
-                print(file=file)
-                print(file=file)
+                frame_buf.append(b'\n\n')
 
-        print(file=file)
-        print(file=file)
+        frame_buf.append(b'\n\n')
 
         if board.is_solved():
             playing = False
-            print(f'Congratulations, you won!', file=file)
+            frame_buf.append(b'Congratulations, you won!\n')
+            renderer.draw(b''.join(frame_buf))
             continue
 
         if selected_vial_index is None:
-            print('Select a vial by typing the number to its left.', file=file)
-            print(f'Or, enter "help" for more commands.', file=file)
+            frame_buf.append(b'Select a vial by typing the number to its left.\n')
+            frame_buf.append(b'Or, enter "help" for more commands.\n')
         else:
-            print(f'Selected vial {selected_vial_index+1}. Now, select a destination vial.', file=file)
-            print(f'Or, enter "c" to cancel.', file=file)
+            frame_buf.append(f'Selected vial {selected_vial_index+1}. Now, select a destination vial.\n'.encode('ascii'))
+            frame_buf.append(b'Or, enter "c" to cancel.\n')
 
         if comment is not None:
-            print(file=file)
-            print(comment, file=file)
+            frame_buf.append(b'\n')
+            frame_buf.append(f'{comment}\n'.encode('utf-8'))
         comment = None
 
-        print('> ', end='', file=sys.stderr)
+        frame_buf.append(b'> ')
 
-        user_line = input().strip()
+        renderer.draw(b''.join(frame_buf))
+
+        if termios is not None and sys.stdin.isatty():
+            with _raw_mode(sys.stdin):
+                user_line = _read_command(board.get_num_vials(), file)
+        else:
+            user_line = input().strip()
 
         if len(user_line) == 0:
             continue
 
-        try:
-            vial_index = int(user_line) - 1
-
-            if vial_index < 0 or vial_index >= board.get_num_vials():
-                comment = 'That vial does not exist'
-                continue
-
-            if selected_vial_index is None:
+        handler = _COMMANDS.get(user_line.lower())
 
-                if board.is_vial_empty(vial_index):
-                    comment = 'That vial is empty'
-                    continue
-
-                selected_vial_index = vial_index
-
-            else:
-                if selected_vial_index != vial_index:
-                    board.pour(selected_vial_index, vial_index)
-                selected_vial_index = None
+        if handler is not None:
+            selected_vial_index, comment = handler(board, selected_vial_index)
+            continue
 
+        try:
+            vial_index = int(user_line) - 1
         except ValueError:
-            pass
-
-        if user_line == 'c' or user_line == 'C':
-            selected_vial_index = None
             continue
 
-        if user_line == 'v' or user_line == 'V':
-            board.add_empty_vial()
+        if vial_index < 0 or vial_index >= board.get_num_vials():
+            comment = 'That vial does not exist'
             continue
 
-        if user_line.lower() == 'help':
-            lines = [
-                #================================================================================
-                'help: Show this message',
-                'u: Undo last action',
-                'v: Add an empty vial',
-            ]
-            comment = '\n'.join(lines)
-
-        if user_line == 'u' or user_line == 'U' or user_line.lower() == 'undo':
-            board.undo()
-            continue
+        if selected_vial_index is None:
 
-        if user_line.lower() == 'xyzzy':
-            comment = 'Nothing happens'
-            continue
+            if board.is_vial_empty(vial_index):
+                comment = 'That vial is empty'
+                continue
+
+            selected_vial_index = vial_index
+
+        else:
+            if selected_vial_index != vial_index:
+                board.pour(selected_vial_index, vial_index)
+            selected_vial_index = None
 
 
 def main(argv):
@@ -375,19 +753,21 @@ def main(argv):
 
 
     with open(puzzle_file_path, 'r', encoding='utf-8') as puzzle_file:
+        # readlines splits only on line breaks, whereas str.splitlines would also split on characters that JSON allows inside strings.
+        lines = puzzle_file.readlines()
 
-        line_no = 0
+    line_no = 0
 
-        for line in puzzle_file:
-            line_no = line_no + 1
+    for line in lines:
+        line_no = line_no + 1
 
-            try:
-                board = load_board(line)
-            except ValueError as e:
-                print(f'Failed to load board from line {line_no}: {e}', file=sys.stderr)
-                return 1
+        try:
+            board = load_board(line)
+        except ValueError as e:
+            print(f'Failed to load board from line {line_no}: {e}', file=sys.stderr)
+            return 1
 
-            play_board(board)
+        play_board(board)
 
 
 if __name__ == '__main__':
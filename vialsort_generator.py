@@ -27,12 +27,7 @@ def generate_random_vials(num_vials, vial_size, rand):
 
     rand.shuffle(items_to_distribute)
 
-    ret = list()
-
-    for i in range(0, num_vials*vial_size, vial_size):
-        ret.append(items_to_distribute[i:i+vial_size])
-
-    return ret
+    return [items_to_distribute[i:i+vial_size] for i in range(0, num_vials*vial_size, vial_size)]
 
 
 def main(argv):